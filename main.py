@@ -1,45 +1,106 @@
 import argparse
 import asyncio
 import httpx
-import statistics
 from time import perf_counter_ns
 import numpy as np
 import plotly.graph_objs as go
 import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
 import json
+import base64
 import math
 
-
-def calculate_ramp_up_step(start_requests, max_requests, duration):
-    """Calculate the ramp-up step based on the start requests, max requests, and total duration."""
-    total_steps = duration // 5  # Assuming 5 seconds per step
-    ramp_up_step = math.ceil((max_requests - start_requests) / total_steps)
+try:
+    import uvloop  # Optional: faster libuv-based event loop
+except ImportError:
+    uvloop = None
+
+# Headers sent with every pre-serialized JSON request body
+JSON_HEADERS = {"content-type": "application/json"}
+
+# Consecutive resends allowed for one request rejected by a closing connection before giving up
+MAX_CONNECTION_RETRIES = 3
+
+# Plotly.js is loaded once from the CDN instead of being inlined with every figure
+PLOTLY_CDN_URL = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+# Renders each report figure the first time its placeholder scrolls into view
+LAZY_PLOT_SCRIPT = """
+    const observer = new IntersectionObserver((entries) => {
+        for (const entry of entries) {
+            if (!entry.isIntersecting) continue;
+            const el = entry.target;
+            observer.unobserve(el);
+            const fig = JSON.parse(document.getElementById(el.dataset.plotId).textContent);
+            Plotly.newPlot(el, fig.data, fig.layout, {responsive: true});
+        }
+    }, {rootMargin: "200px"});
+    document.querySelectorAll(".plot").forEach((el) => observer.observe(el));
+"""
+
+
+def calculate_ramp_up_step(start_requests, max_requests, steps):
+    """Calculate the ramp-up step based on the start requests, max requests, and number of steps."""
+    ramp_up_step = max(1, math.ceil((max_requests - start_requests) / steps))
     return ramp_up_step
 
 
-async def send_request(client, url, payload):
-    """Send a single request and measure the processing time in milliseconds."""
-    start_time = perf_counter_ns()
-    response = await client.post(url, json=payload)
-    end_time = perf_counter_ns()
-    process_time_ms = (end_time - start_time) / 1_000_000  # Convert nanoseconds to milliseconds
-    return process_time_ms
-
-
-async def ramp_up_requests(url, payload, num_requests, duration):
-    """Send concurrent requests for a specified duration and collect response times."""
-    async with httpx.AsyncClient() as client:
-        start_time = perf_counter_ns()
-        process_times = []
-        while (perf_counter_ns() - start_time) / 1_000_000_000 < duration:
-            tasks = [send_request(client, url, payload) for _ in range(num_requests)]
-            response_times = await asyncio.gather(*tasks)
-            process_times.extend(response_times)
-        return process_times
+def rejected_by_closing_connection(exc):
+    """Return True if a request failed because the server was closing the connection, so it can be resent."""
+    if isinstance(exc, httpx.RemoteProtocolError):
+        # An HTTP/2 GOAWAY, e.g. once the server's per-connection request limit is reached. hypercorn sends a
+        # graceful NO_ERROR GOAWAY and follows it with a PROTOCOL_ERROR one for streams that raced it.
+        event = exc.__cause__.args[0] if exc.__cause__ is not None and exc.__cause__.args else None
+        return hasattr(event, 'last_stream_id')
+    # Requests racing the GOAWAY also fail locally (stream limit on the replacement connection) or on the
+    # closed socket. At worst the server handles one extra request, and no time is recorded for it; a
+    # persistent failure still surfaces after MAX_CONNECTION_RETRIES consecutive attempts.
+    return isinstance(exc, (httpx.LocalProtocolError, httpx.WriteError, httpx.ReadError))
+
+
+async def ramp_up_requests(client, url, body, headers, num_requests, duration):
+    """Keep num_requests requests in flight for a specified duration and collect response times."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    # Bound methods looked up once per step rather than on every request
+    now = loop.time
+    post = client.post
+
+    # Start from a small buffer and let the workers double it as responses come in
+    times_ns = np.empty(max(1024, num_requests * 64), dtype=np.int64)
+    written = 0
+
+    async def worker():
+        # Each worker issues its next request as soon as the previous one completes
+        nonlocal times_ns, written
+        retries = 0
+        while now() < deadline:
+            start_time = perf_counter_ns()
+            try:
+                await post(url, content=body, headers=headers)
+            except (httpx.ProtocolError, httpx.NetworkError) as exc:
+                # Resend (without recording a time) requests the server rejected while closing the connection
+                if retries == MAX_CONNECTION_RETRIES or not rejected_by_closing_connection(exc):
+                    raise
+                retries += 1
+                continue
+            elapsed_ns = perf_counter_ns() - start_time
+            retries = 0
+            if written == times_ns.size:
+                times_ns = np.concatenate((times_ns, np.empty_like(times_ns)))  # Double the buffer when it fills up
+            times_ns[written] = elapsed_ns
+            written += 1
+
+    await asyncio.gather(*[worker() for _ in range(num_requests)])
+    return times_ns[:written] * 1e-6  # Convert nanoseconds to milliseconds
 
 
 async def main():
     """Main function to parse arguments, run the test, and generate the report."""
+    # Run request coroutines eagerly until their first suspension (Python 3.12+)
+    if hasattr(asyncio, 'eager_task_factory'):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
     parser = argparse.ArgumentParser(description="Performance testing tool for FastAPI services.")
 
     parser.add_argument('--url', type=str, required=True, help="The URL of the FastAPI endpoint.")
@@ -48,19 +109,44 @@ async def main():
     parser.add_argument('--start-requests', type=int, required=True, help="Initial number of concurrent requests.")
     parser.add_argument('--max-requests', type=int, required=True, help="Maximum number of concurrent requests.")
     parser.add_argument('--duration', type=int, required=True, help="Total duration of the test in seconds.")
+    parser.add_argument('--steps', type=int, default=10,
+                        help="Number of ramp-up increments between start and max concurrent requests. The test runs "
+                             "one concurrency level per increment plus the starting level (usually steps + 1 levels), "
+                             "and the total duration is split evenly across those levels.")
     parser.add_argument('--output-file', type=str, help="The name of the output HTML file.")
+    parser.add_argument('--http2', action='store_true',
+                        help="Multiplex all requests over a single HTTP/2 connection. The server must speak HTTP/2 "
+                             "(h2c with prior knowledge for http:// URLs).")
+    parser.add_argument('--static', action='store_true',
+                        help="Embed the charts as static SVG images instead of interactive plots. "
+                             "Requires kaleido and Google Chrome (install Chrome with `plotly_get_chrome`).")
 
     args = parser.parse_args()
 
+    if args.steps < 1:
+        parser.error("--steps must be at least 1")
+    if args.max_requests < args.start_requests:
+        parser.error("--max-requests must be >= --start-requests")
+
+    if args.static:
+        # Render a throwaway figure now so a missing kaleido or Chrome fails before the benchmark runs
+        try:
+            go.Figure().to_image(format='svg')
+        except (ValueError, RuntimeError) as e:
+            parser.error(f"--static could not render an image: {e}")
+
     url = args.url
     payload = json.loads(args.payload)  # Convert the JSON string to a dictionary
+    # Serialize the payload once (compactly) so httpx doesn't re-encode it on every request
+    body = json.dumps(payload, separators=(',', ':')).encode()
     start_requests = args.start_requests
     max_requests = args.max_requests
     duration = args.duration
 
-    # Calculate ramp-up step based on provided arguments
-    ramp_up_step = calculate_ramp_up_step(start_requests, max_requests, duration)
-    duration_per_step = 5  # Fixed duration per step in seconds
+    # Calculate ramp-up step based on provided arguments and split the total duration evenly across the steps
+    ramp_up_step = calculate_ramp_up_step(start_requests, max_requests, args.steps)
+    concurrency_levels = range(start_requests, max_requests + 1, ramp_up_step)
+    duration_per_step = duration / max(1, len(concurrency_levels))
 
     # Generate default output filename if not provided
     if args.output_file:
@@ -72,32 +158,46 @@ async def main():
     html_title = output_file.replace(".html", "")
 
     # Data structures to store results
-    average_response_times = []
     concurrent_users = []
     all_process_times = []
 
-    for num_requests in range(start_requests, max_requests + 1, ramp_up_step):
-        print(f"Running with {num_requests} concurrent requests...")
-        process_times = await ramp_up_requests(url, payload, num_requests, duration_per_step)
-
-        if process_times:
-            avg_response_time = statistics.mean(process_times)
-            average_response_times.append(avg_response_time)
-            concurrent_users.append(num_requests)
-            all_process_times.append(process_times)
-            print(f"Average response time with {num_requests} users: {avg_response_time:.2f} ms")
-
-        # Ramp-up interval (sleep 1 second between steps)
-        await asyncio.sleep(1)
-
-    # Generate the interactive Plotly report
-    save_plots_to_html(concurrent_users, average_response_times, all_process_times, duration_per_step, output_file,
-                       html_title)
-
-
-def save_plots_to_html(concurrent_users, average_response_times, all_process_times, duration_per_step, output_file,
-                       html_title):
-    """Generates and saves interactive performance plots as an HTML file."""
+    # Share one client (and its connection pool) across all ramp-up steps
+    if args.http2:
+        # A single HTTP/2 connection carries every request as a separate stream
+        limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        client = httpx.AsyncClient(limits=limits, http1=False, http2=True)
+    else:
+        # HTTP/1.1 keep-alive pool with room for every concurrent request
+        limits = httpx.Limits(max_connections=max_requests * 2, max_keepalive_connections=max_requests * 2)
+        client = httpx.AsyncClient(limits=limits)
+    async with client:
+        for num_requests in concurrency_levels:
+            print(f"Running with {num_requests} concurrent requests...")
+            process_times = await ramp_up_requests(client, url, body, JSON_HEADERS, num_requests, duration_per_step)
+
+            if process_times.size:
+                avg_response_time = process_times.mean()
+                concurrent_users.append(num_requests)
+                all_process_times.append(process_times)
+                print(f"Average response time with {num_requests} users: {avg_response_time:.2f} ms")
+
+            # Ramp-up interval (sleep 1 second between steps)
+            await asyncio.sleep(1)
+
+    # Generate the Plotly report
+    save_plots_to_html(concurrent_users, all_process_times, duration_per_step, output_file, html_title,
+                       static=args.static)
+
+
+def save_plots_to_html(concurrent_users, all_process_times, duration_per_step, output_file, html_title, static=False):
+    """Generates and saves performance plots as an HTML file, either interactive or as static SVG images."""
+
+    # Flatten all steps into one array of response times plus per-step sizes and start offsets,
+    # so per-step aggregates are single reduceat calls instead of one NumPy call per step
+    step_sizes = np.array([times.size for times in all_process_times], dtype=np.intp)
+    step_starts = np.cumsum(step_sizes) - step_sizes
+    flat_times = np.concatenate(all_process_times) if all_process_times else np.empty(0)
+    average_response_times = np.add.reduceat(flat_times, step_starts) / step_sizes
 
     # Plot: Average Response Time vs Number of Concurrent Users
     fig_avg_response = go.Figure()
@@ -108,7 +208,7 @@ def save_plots_to_html(concurrent_users, average_response_times, all_process_tim
                                    yaxis_title='Average Response Time (ms)')
 
     # Plot: 95th Percentile Response Time vs Number of Concurrent Users
-    percentiles = [np.percentile(times, 95) for times in all_process_times]
+    percentiles = np.array([np.percentile(times, 95) for times in all_process_times])
     fig_95th_percentile = go.Figure()
     fig_95th_percentile.add_trace(
         go.Scatter(x=concurrent_users, y=percentiles, mode='lines+markers', name='95th Percentile Response Time',
@@ -118,7 +218,7 @@ def save_plots_to_html(concurrent_users, average_response_times, all_process_tim
                                       yaxis_title='95th Percentile Response Time (ms)')
 
     # Plot: Maximum Response Time vs Number of Concurrent Users
-    max_times = [max(times) for times in all_process_times]
+    max_times = np.maximum.reduceat(flat_times, step_starts)
     fig_max_response = go.Figure()
     fig_max_response.add_trace(
         go.Scatter(x=concurrent_users, y=max_times, mode='lines+markers', name='Max Response Time',
@@ -127,10 +227,12 @@ def save_plots_to_html(concurrent_users, average_response_times, all_process_tim
                                    xaxis_title='Number of Concurrent Users',
                                    yaxis_title='Maximum Response Time (ms)')
 
-    # Plot: Response Time Distribution
+    # Plot: Response Time Distribution (pre-binned so only bin counts are embedded in the report)
     fig_distribution = go.Figure()
     for users, times in zip(concurrent_users, all_process_times):
-        fig_distribution.add_trace(go.Histogram(x=times, name=f'{users} Users', opacity=0.75))
+        counts, edges = np.histogram(times, bins=100)
+        fig_distribution.add_trace(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges),
+                                          name=f'{users} Users', opacity=0.75))
     fig_distribution.update_layout(title='Response Time Distribution for Different Concurrent Users',
                                    xaxis_title='Response Time (ms)',
                                    yaxis_title='Frequency',
@@ -138,7 +240,7 @@ def save_plots_to_html(concurrent_users, average_response_times, all_process_tim
     fig_distribution.update_traces(opacity=0.5)
 
     # Plot: Throughput vs Number of Concurrent Users
-    throughputs = [len(times) / duration_per_step for times in all_process_times]
+    throughputs = step_sizes / duration_per_step
     fig_throughput = go.Figure()
     fig_throughput.add_trace(go.Scatter(x=concurrent_users, y=throughputs, mode='lines+markers', name='Throughput',
                                         line=dict(color='green')))
@@ -146,20 +248,19 @@ def save_plots_to_html(concurrent_users, average_response_times, all_process_tim
                                  xaxis_title='Number of Concurrent Users',
                                  yaxis_title='Throughput (Requests per Second)')
 
-    # Combine plots into a table format
-    plots = [
-        pio.to_html(fig_avg_response, full_html=False),
-        pio.to_html(fig_95th_percentile, full_html=False),
-        pio.to_html(fig_max_response, full_html=False),
-        pio.to_html(fig_distribution, full_html=False),
-        pio.to_html(fig_throughput, full_html=False)
+    # Table layout: two plots per row, with the throughput plot spanning the last row
+    rows = [
+        [fig_avg_response, fig_95th_percentile],
+        [fig_max_response, fig_distribution],
+        [fig_throughput],
     ]
 
     # Create the HTML structure with a table
-    html_content = f"""
+    html_header = f"""
     <html>
     <head>
         <title>{html_title}</title>
+        {"" if static else f'<script charset="utf-8" src="{PLOTLY_CDN_URL}"></script>'}
         <style>
             body {{
                 font-family: Arial, sans-serif;
@@ -197,33 +298,56 @@ def save_plots_to_html(concurrent_users, average_response_times, all_process_tim
             .plot-container {{
                 padding: 10px;
             }}
+            .plot {{
+                min-height: 450px;
+            }}
         </style>
     </head>
     <body>
         <h1>{html_title}</h1>
         <table>
-            <tr>
-                <td class="plot-container">{plots[0]}</td>
-                <td class="plot-container">{plots[1]}</td>
-            </tr>
-            <tr>
-                <td class="plot-container">{plots[2]}</td>
-                <td class="plot-container">{plots[3]}</td>
-            </tr>
-            <tr>
-                <td class="plot-container" colspan="2">{plots[4]}</td>
-            </tr>
-        </table>
+"""
+    html_footer = f"""        </table>
+        {"" if static else f"<script>{LAZY_PLOT_SCRIPT}</script>"}
     </body>
     </html>
     """
 
-    with open(output_file, "w") as f:
-        f.write(html_content)
+    # Render static figures to SVG before the output file is opened, so a rendering failure
+    # doesn't leave a truncated report behind
+    if static:
+        svgs = {id(fig): base64.b64encode(fig.to_image(format='svg')).decode() for row in rows for fig in row}
 
-    print(f"Interactive performance report saved to '{output_file}'.")
+    # Stream the report to disk one figure at a time instead of building it as one string.
+    # Interactive figures are embedded as JSON next to an empty placeholder and only drawn once scrolled
+    # into view; static figures are embedded as SVG images and need no JavaScript at all.
+    with open(output_file, "w") as f:
+        f.write(html_header)
+        plot_id = 0
+        for row in rows:
+            colspan = ' colspan="2"' if len(row) == 1 else ''
+            f.write("            <tr>\n")
+            for fig in row:
+                f.write(f'                <td class="plot-container"{colspan}>')
+                if static:
+                    f.write(f'<img src="data:image/svg+xml;base64,{svgs[id(fig)]}">')
+                else:
+                    f.write(f'<div class="plot" data-plot-id="plot-{plot_id}"></div>'
+                            f'<script type="application/json" id="plot-{plot_id}">')
+                    # Escape "</" so the JSON cannot close its <script> tag early
+                    f.write(pio.to_json(fig).replace("</", "<\\/"))
+                    f.write("</script>")
+                f.write("</td>\n")
+                plot_id += 1
+            f.write("            </tr>\n")
+        f.write(html_footer)
+
+    print(f"{'Static' if static else 'Interactive'} performance report saved to '{output_file}'.")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
 
@@ -1,3 +1,4 @@
+import argparse
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
 import time
@@ -8,18 +9,21 @@ from functools import wraps
 # Initialize FastAPI app
 app = FastAPI()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging (WARNING by default so per-request logging doesn't cap throughput under load;
+# set to INFO to log each endpoint's response time)
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
 
 # Decorator for logging response time
 def log_response_time(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        start_time = time.time()
+        start_time = time.perf_counter()
         response = await func(*args, **kwargs)
-        process_time = time.time() - start_time
-        logging.info(f"Response time: {process_time} seconds")
-        return {'process_time':process_time}
+        process_time = time.perf_counter() - start_time
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Response time: %s seconds", process_time)
+        return response
     return wrapper
 
 # Pydantic model for power request payload
@@ -31,15 +35,19 @@ class PowerRequest(BaseModel):
 class SquareRequest(BaseModel):
     number: float
 
+# Pydantic model for the result returned by both endpoints
+class ResultResponse(BaseModel):
+    result: float
+
 # Endpoint to calculate power of a given number
-@app.post("/calculate-power")
+@app.post("/calculate-power", response_model=ResultResponse)
 @log_response_time
 async def calculate_power(payload: PowerRequest):
     result = payload.number ** payload.power
     return {"result": result}
 
 # Endpoint to calculate square of a given number
-@app.post("/calculate-square")
+@app.post("/calculate-square", response_model=ResultResponse)
 @log_response_time
 async def calculate_square(payload: SquareRequest):
     result = payload.number ** 2
@@ -47,5 +55,13 @@ async def calculate_square(payload: SquareRequest):
 
 # Run the FastAPI application
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description="Sample FastAPI service for performance testing.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of uvicorn worker processes.")
+    args = parser.parse_args()
+
+    # uvicorn picks uvloop and httptools automatically (installed via uvicorn[standard] in the Pipfile);
+    # the access log is disabled so it doesn't add a log line per request.
+    # Multiple workers require the app as an import string.
+    uvicorn.run(app if args.workers == 1 else "server:app", host="0.0.0.0", port=8000, workers=args.workers,
+                log_level="warning", access_log=False)
 